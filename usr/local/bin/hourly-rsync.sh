@@ -61,10 +61,35 @@ else
   COURSE="${JNOTE_COURSE_CODE}"
 fi
 
-# Array of User Home Directories
-HOME_ARRAY=("${HOMEDIR}"/*/)          # This creates an array of the full paths to all subdirs
-HOME_ARRAY=("${HOME_ARRAY[@]%/}")     # This removes the trailing slash on each item
-HOME_ARRAY=("${HOME_ARRAY[@]##*/}")   # This gets rid of Path
+if [[ -n "${JNOTE_ROSTER}" ]]; then
+  # Enrolled Students From the Course Roster, Stop if the Roster Can Not be Read
+  STUDENTS=$(python3 /usr/share/jupyter-canvas-api/roster.py "${JNOTE_ROSTER}") || exit 1
+
+  # Nothing to Copy
+  if [[ -z "${STUDENTS}" ]]; then
+    echo "Course Roster Lists No Students: ${JNOTE_ROSTER}"
+    exit 0
+  fi
+
+  # Array of Enrolled Students That Have a Home Directory
+  HOME_ARRAY=()
+  while read -r STUDENT; do
+    if [[ -d "${HOMEDIR}${STUDENT}" ]]; then
+      HOME_ARRAY+=("${STUDENT}")
+    fi
+  done <<< "${STUDENTS}"
+else
+  # Array of User Home Directories
+  HOME_ARRAY=("${HOMEDIR}"/*/)          # This creates an array of the full paths to all subdirs
+  HOME_ARRAY=("${HOME_ARRAY[@]%/}")     # This removes the trailing slash on each item
+  HOME_ARRAY=("${HOME_ARRAY[@]##*/}")   # This gets rid of Path
+fi
+
+# Nothing to Copy
+if [ "${#HOME_ARRAY[@]}" -eq 0 ]; then
+    echo "No Student Home Directories Found"
+    exit 0
+fi
 
 COUNT=0  # COUNT Variable To Loop Thru HOME_ARRAY
 RUNNING=1  # RUNNING Variable to Control While Loop
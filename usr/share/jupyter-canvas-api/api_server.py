@@ -9,15 +9,20 @@ snapshots of student’s directories, list files within a students’ snapshot,
 such as reports into the students’ home directory.
 """
 
+import collections
 import datetime
 import fcntl
 import glob
+import hashlib
 import io
+import json
 import logging
 import os
 import pathlib
 import re
 import shutil
+import stat
+import threading
 import time
 import unicodedata
 import uuid
@@ -30,6 +35,8 @@ import sysrsync
 from flask import Flask, request, jsonify, abort, make_response
 from werkzeug.utils import secure_filename
 
+from roster import Roster
+
 __author__ = "Rahim Khoja"
 __credits__ = ["Rahim Khoja", "Balaji Srinivasarao", "Pan Luo"]
 __license__ = "GPL"
@@ -48,6 +55,13 @@ SNAPSHOT_DIR = os.path.join(str(os.getenv('JNOTE_SNAP', '/mnt/efs/stat-100a-snap
 INTERMEDIARY_DIR = os.path.join(str(os.getenv('JNOTE_INTSNAP', '/mnt/efs/stat-100a-internal/')), '')  # Intermediary Snapshot Directory
 all_directories = [HOMEDIR, SNAPSHOT_DIR, INTERMEDIARY_DIR]
 COURSE_CODE = str(os.getenv('JNOTE_COURSE_CODE', 'STAT100a'))  # The API Course Code
+ROSTER_FILE = str(os.getenv('JNOTE_ROSTER', ''))  # Canvas Course Roster Export (CSV or JSON), Optional
+SIGNATURE_FILENAME = '.signatures.json'  # Per Student Record of Home Directory Signatures for Each Snapshot
+STAGING_DIRNAME = '.staging'  # Per Student Directory of In Progress Snapshots and Their Manifests
+LOCK_DIR = '/var/lock/'  # Student Lock File Directory, Shared with the Hourly RSYNC Script
+
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '4096'))  # Max Cached Filesystem Metadata Entries
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', '30'))  # Seconds Filesystem Metadata Stays Cached
 
 UPLOAD_FOLDER = os.path.join('/tmp', 'uploads')  # Temporary Upload Folder
 ALLOWED_EXTENSIONS = {'txt', 'html', 'htm', 'ipynb'}  # Allowed Upload File Types
@@ -83,6 +97,498 @@ def slugify(value, allow_unicode=False):
     return re.sub(r'[-\s]+', '-', value).strip('-_')
 
 
+def directory_signature(path, include_hidden=False):
+    """
+    Build a Merkle-style signature of the directory tree at 'path'.
+    Every file contributes its name, mtime, size and inode, and every directory
+    contributes the signature of its children, so any change anywhere in the tree
+    changes the root signature. File contents are never read. Directories are
+    listed on every call, since their mtime can miss entries added within the
+    filesystem's timestamp granularity. Hidden entries are skipped unless
+    'include_hidden' is True, matching the rsync exclusions used for snapshots.
+    """
+    digest = hashlib.sha256()
+
+    for name in sorted(os.listdir(path)):
+        if not include_hidden and name.startswith('.'):
+            continue
+        entry_path = os.path.join(path, name)
+        try:
+            entry_stat = os.lstat(entry_path)
+        except FileNotFoundError:  # Entry Removed Since the Directory was Listed
+            continue
+        if stat.S_ISDIR(entry_stat.st_mode):
+            try:
+                child_signature = directory_signature(entry_path, include_hidden)
+            except FileNotFoundError:  # Directory Removed Since it was Checked
+                continue
+            digest.update(('d\0' + name + '\0' + child_signature + '\n').encode())
+        else:
+            digest.update(('f\0' + name + '\0' + str(entry_stat.st_mtime_ns) + '\0' + str(entry_stat.st_size)
+                           + '\0' + str(entry_stat.st_ino) + '\n').encode())
+
+    return digest.hexdigest()
+
+
+def read_signatures(student_id):
+    """ Read the Recorded Home Directory Signatures for Each of the Student's Snapshots. """
+
+    signature_file = SNAPSHOT_DIR + student_id + '/' + SIGNATURE_FILENAME
+    try:
+        with open(signature_file) as OPEN_FILE:
+            return json.load(OPEN_FILE)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_signatures(student_id, signatures):
+    """ Atomically Replace the Recorded Snapshot Signatures for the Student. """
+
+    write_json_file(SNAPSHOT_DIR + student_id + '/' + SIGNATURE_FILENAME, signatures)
+
+
+def find_unchanged_snapshot(student_id, signature, include_hidden):
+    """ Return the Name of an Existing Snapshot Taken From an Identical Home Directory, or None. """
+
+    for name, record in reversed(list(read_signatures(student_id).items())):
+        if (record.get('signature') == signature
+                and record.get('include_hidden') == include_hidden
+                and os.path.isdir(SNAPSHOT_DIR + student_id + '/' + name)):
+            return name
+    return None
+
+
+def lock_student(student_id, blocking=True):
+    """
+    Take the Student's Exclusive FLOCK, Shared with the Hourly RSYNC Script.
+    Returns the Open Lock File, or None if 'blocking' is False and the Lock is Held.
+    """
+
+    lockfile = LOCK_DIR + COURSE_CODE + '_' + student_id + '.lock'  # Lock File For Student
+
+    # Create FLOCK or Wait 2 Seconds
+    while True:
+        try:
+            lockfile_obj = open(lockfile, 'w+')  # Open Lock File, Create if Does Not Exist
+            fcntl.flock(lockfile_obj, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Create Non Blocking Exclusive Flock
+            return lockfile_obj  # Return if no Errors
+        except Exception:
+            if not blocking:
+                return None
+            time.sleep(2)
+
+
+def unlock_student(lockfile_obj):
+    """ Release the Student's FLOCK and Remove the Lock File. """
+
+    fcntl.flock(lockfile_obj, fcntl.LOCK_UN)
+    lockfile_obj.close()
+    try:
+        os.remove(lockfile_obj.name)
+    except FileNotFoundError:
+        pass
+
+
+def write_json_file(file_path, data):
+    """ Atomically Replace 'file_path' with 'data' Encoded as JSON. """
+
+    temp_file_path = file_path + '.' + uuid.uuid4().hex
+    with open(temp_file_path, 'w') as OPEN_FILE:
+        json.dump(data, OPEN_FILE)
+        OPEN_FILE.flush()
+        os.fsync(OPEN_FILE.fileno())
+    os.replace(temp_file_path, file_path)
+
+
+def commit_snapshot(student_id, snapshot_name_clean, manifest):
+    """
+    Finish a Staged Snapshot: Rename the Staging Directory into Place, Record its
+    Signature and Remove the Manifest. Every Step Can be Safely Repeated, so an
+    Interrupted Commit is Completed by Running it Again. If a different snapshot
+    already holds the final path, the staged copy is discarded and its signature
+    is not recorded. Returns True if the staged snapshot is now in place.
+    """
+
+    snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+    snap_name_path = snap_student_path + '/' + snapshot_name_clean  # Student Snapshot Path
+    staging_path = snap_student_path + '/' + STAGING_DIRNAME + '/' + snapshot_name_clean  # Staging Path
+    manifest_path = staging_path + '.json'  # Staging Manifest Path
+
+    if os.path.isdir(snap_name_path) and os.path.isdir(staging_path):
+        # Another Snapshot Took the Final Path, Discard This Copy
+        logger.error("Snapshot " + snapshot_name_clean + " Already Exists for Student: " + student_id
+                     + ", Discarding Staged Copy")
+        shutil.rmtree(staging_path)
+        os.remove(manifest_path)
+        return False
+
+    # Atomic Rename of the Complete Staging Directory to the Final Snapshot Path
+    # A Missing Staging Directory Means This Rename Already Happened Before an Interruption
+    if not os.path.isdir(snap_name_path):
+        os.rename(staging_path, snap_name_path)
+    metadata_cache.invalidate(snap_student_path)
+
+    # Record the Signature the New Snapshot was Taken From
+    signatures = read_signatures(student_id)
+    signatures[snapshot_name_clean] = {'signature': manifest['signature'],
+                                       'include_hidden': manifest['include_hidden']}
+    write_signatures(student_id, signatures)
+
+    os.remove(manifest_path)
+    return True
+
+
+def rollback_snapshot(student_id, snapshot_name_clean, manifest):
+    """
+    Abandon a Snapshot That Was Not Fully Staged. Partial rsync copies are moved to the
+    intermediary directory, if it is free, so the next snapshot of the student resumes
+    from them; anything else in the staging directory is removed along with the manifest.
+    """
+
+    staging_path = SNAPSHOT_DIR + student_id + '/' + STAGING_DIRNAME + '/' + snapshot_name_clean  # Staging Path
+    manifest_path = staging_path + '.json'  # Staging Manifest Path
+    intsnap_student_path = INTERMEDIARY_DIR + student_id
+
+    logger.info("Rolling Back Snapshot " + snapshot_name_clean + " for Student: " + student_id)
+    if os.path.isdir(staging_path):
+        if manifest.get('linked_from') is None and not os.path.exists(intsnap_student_path):
+            shutil.move(staging_path, intsnap_student_path)
+        else:
+            shutil.rmtree(staging_path)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def take_snapshot(student_id, snapshot_name_clean, include_hidden):
+    """
+    Snapshot the Student's Home Directory into SNAPSHOT_DIR/<student_id>/<snapshot_name_clean>.
+    The snapshot is built in a staging directory next to the final path and described by a
+    manifest, then committed with an atomic rename, so readers never see a partial snapshot.
+    If the copy fails, the partial copy is moved to the intermediary directory so a
+    retry resumes from it.
+    If the home directory signature matches an earlier snapshot, the new snapshot is
+    created as a hard linked copy of that snapshot instead of running rsync.
+    Returns True if the snapshot was linked from an earlier snapshot, False if it was
+    copied, and None if a snapshot of that name already exists.
+    """
+
+    student_path = HOMEDIR + student_id  # Student Home Directory Path
+    snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+    snap_name_path = snap_student_path + '/' + snapshot_name_clean  # Student Snapshot Path
+    staging_student_path = snap_student_path + '/' + STAGING_DIRNAME  # Student Staging Directory Path
+    staging_path = staging_student_path + '/' + snapshot_name_clean  # Staging Path
+    manifest_path = staging_path + '.json'  # Staging Manifest Path
+    intsnap_student_path = INTERMEDIARY_DIR + student_id
+
+    lockfile_obj = lock_student(student_id)
+    manifest = None
+
+    try:
+        # Re-check Under the Lock, as Another Request May Have Created the Snapshot While This One Waited
+        if os.path.isdir(snap_name_path):
+            logger.info("Snapshot " + snapshot_name_clean + " Already Exists for Student: " + student_id)
+            return None
+
+        # Create Student Staging Directory Structure Inside the Final Snapshot Directory If Missing
+        Path(staging_student_path).mkdir(parents=True, exist_ok=True)
+
+        # Signature is Taken Before Copying, so Changes During the Copy Force a Full Copy Next Time
+        signature = directory_signature(student_path, include_hidden)
+        unchanged_snapshot = find_unchanged_snapshot(student_id, signature, include_hidden)
+
+        # Journal the Snapshot Before Touching the Staging Directory
+        manifest = {'state': 'staging', 'signature': signature, 'include_hidden': include_hidden,
+                    'linked_from': unchanged_snapshot}
+        write_json_file(manifest_path, manifest)
+
+        if unchanged_snapshot:
+            # Hard Link the Unchanged Snapshot Instead of Copying the Home Directory Again
+            logger.info("Home Unchanged Since Snapshot " + unchanged_snapshot + " for Student: " + student_id)
+            if os.path.isdir(staging_path):
+                shutil.rmtree(staging_path)  # Links are Cheap, Redo Partial Linked Copies From Scratch
+            shutil.copytree(snap_student_path + '/' + unchanged_snapshot, staging_path,
+                            symlinks=True, copy_function=os.link)
+        else:
+            # Seed New Staging Directories From the Hourly Intermediary Copy so RSYNC Only Sends Changes
+            if not os.path.isdir(staging_path) and os.path.isdir(intsnap_student_path):
+                shutil.move(intsnap_student_path, staging_path)
+
+            options = ['-a', '-v', '-h', '-W', '--delete']
+            if include_hidden:
+                exclusions = None
+            else:
+                exclusions = ['.*']
+                options.append('--delete-excluded')
+            # RSYNC Student Home to Staging Directory, Resuming Any Partial Copy Left There
+            sysrsync.run(source=student_path,
+                         destination=staging_path,
+                         sync_source_contents=True,
+                         options=options, exclusions=exclusions)
+
+        manifest['state'] = 'staged'
+        write_json_file(manifest_path, manifest)
+
+        if not commit_snapshot(student_id, snapshot_name_clean, manifest):
+            return None
+    except Exception:
+        # Do Not Leave a Partial Copy Under SNAPSHOT_DIR When the Copy Fails
+        if manifest is not None and manifest['state'] == 'staging':
+            rollback_snapshot(student_id, snapshot_name_clean, manifest)
+        raise
+    finally:
+        unlock_student(lockfile_obj)
+
+    return unchanged_snapshot is not None
+
+
+def list_snapshots(snap_student_path):
+    """ List the Snapshot Directory Names Within a Student Snapshot Directory. """
+
+    snapshots = [f.path for f in os.scandir(snap_student_path) if f.is_dir()]
+    snapshots = [x for x in snapshots if '.' not in x]
+    return [s.replace(snap_student_path + '/', '') for s in snapshots]
+
+
+def list_snapshot_files(snap_name_path):
+    """ List the Files Within a Snapshot, Relative to the Snapshot Directory. """
+
+    snapshot_files = glob.glob(os.path.join(snap_name_path + '/', '**/*'),
+                               recursive=True)
+    snapshot_files = [f for f in snapshot_files if os.path.isfile(f)]
+    return [s.replace(snap_name_path + '/', '') for s in snapshot_files]
+
+
+def snapshot_zip_members(snapshot_name, student_id=None, students=None):
+    """
+    Yield (Path, Archive Name, Compression Type) for Every Member of a Snapshot Zip File.
+    With a 'student_id' the members are that student's snapshot, otherwise they are the
+    snapshot of the same name from every student in 'students', or from every student
+    snapshot directory if 'students' is None, archived under each student's ID.
+    """
+
+    if student_id:
+        snap_name_path = SNAPSHOT_DIR + student_id + '/' + snapshot_name  # Student Snapshot Path
+        for (dirname, subdirs, files) in os.walk(snap_name_path + '/'):  # Loop Through Snapshot Files and Directories
+            if "/." not in dirname:
+                yield dirname, dirname.replace(SNAPSHOT_DIR, ''), None  # Directory Zip Member
+                for filename in files:  # Loop Through Each File in Snapshot Directory
+                    if "/." not in filename:
+                        yield (os.path.join(dirname, filename),
+                               os.path.join(dirname, filename).replace(SNAPSHOT_DIR, ''),
+                               zf.ZIP_DEFLATED)  # Snapshot File Zip Member
+        return
+
+    if students is not None:
+        # Only Look For the Snapshot in the Given Students' Directories
+        snapshots = [SNAPSHOT_DIR + student + '/' + snapshot_name for student in students
+                     if os.path.isdir(SNAPSHOT_DIR + student + '/' + snapshot_name)]
+    else:
+        snapshots = []
+
+        # loop through students directories to find which one has the snapshot
+        with os.scandir(SNAPSHOT_DIR) as student_dir:
+            for entry in student_dir:
+                if entry.is_dir():
+                    with os.scandir(entry) as snapshot_dir:
+                        for e in snapshot_dir:
+                            # find the snapshot
+                            if e.is_dir() and e.name == snapshot_name:
+                                snapshots.append(e.path)
+
+    for snapshot in snapshots:
+        directory = pathlib.Path(snapshot)
+        for file_path in directory.rglob("*"):
+            yield (str(file_path),
+                   str(file_path.relative_to(SNAPSHOT_DIR)).replace(snapshot_name + '/', ''),
+                   zf.ZIP_DEFLATED)
+
+
+class MetadataCache:
+    """
+    Bounded LRU Cache of Filesystem Metadata, Such as Directory Existence and Listings.
+    Entries expire after 'ttl' seconds so changes made outside the API are picked up,
+    and the API invalidates paths itself whenever it creates snapshots or uploads files.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # Maps (Kind, Path) to (Expiry Time, Value)
+        self.lock = threading.Lock()
+        self.generation = 0  # Incremented by Every Invalidation
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, kind, path, loader):
+        """ Return the Cached 'kind' Value for 'path', Calling loader(path) on a Miss. """
+
+        key = (kind, path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+
+        value = loader(path)
+
+        with self.lock:
+            # Do Not Cache Values Loaded Before an Invalidation Finished
+            if generation == self.generation:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, path):
+        """ Drop Every Cached Entry for 'path' and Everything Below it. """
+
+        path = path.rstrip('/')
+        with self.lock:
+            for key in [k for k in self.entries if k[1] == path or k[1].startswith(path + '/')]:
+                del self.entries[key]
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'invalidations': self.invalidations,
+                    'size': len(self.entries),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl}
+
+
+metadata_cache = MetadataCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+
+def cached_is_dir(path):
+    return metadata_cache.get('is_dir', path, os.path.isdir)
+
+
+def cached_is_file(path):
+    return metadata_cache.get('is_file', path, os.path.isfile)
+
+
+def cached_list_snapshots(snap_student_path):
+    return metadata_cache.get('list_snapshots', snap_student_path, list_snapshots)
+
+
+def cached_list_snapshot_files(snap_name_path):
+    return metadata_cache.get('list_snapshot_files', snap_name_path, list_snapshot_files)
+
+
+course_roster = Roster(ROSTER_FILE)
+
+
+def course_roster_error(section=None, group=None):
+    """
+    Check the Course Roster Before a Course-Wide Operation. Returns (status, error, message)
+    if the operation can not go ahead, otherwise None. A roster that is configured but can
+    not be read fails the operation rather than falling back to every home directory, and
+    an unknown 'section' or 'group' is Not Found.
+    """
+
+    if ROSTER_FILE and not course_roster.loaded:
+        logger.error("Course Roster '" + ROSTER_FILE + "' Could Not be Read, Course-Wide Operation Refused")
+        return (503,
+                'Service Unavailable - Course Roster Could Not be Read',
+                'Service Unavailable - Course Roster File Could Not be Read.')
+
+    if (section or group) and not course_roster.loaded:
+        return (404,
+                'Not Found - Course Roster Not Found',
+                'Not Found - SECTION and GROUP Require a Course Roster File.')
+
+    if section and not course_roster.has_section(section):
+        return (404,
+                'Not Found - Section was Not Found',
+                'Not Found - Section (' + section + ') Not Found in Course Roster.')
+
+    if group and not course_roster.has_group(group):
+        return (404,
+                'Not Found - Group was Not Found',
+                'Not Found - Group (' + group + ') Not Found in Course Roster.')
+
+    return None
+
+
+def course_students(section=None, group=None):
+    """
+    Students for Course-Wide Operations. With a roster loaded these are the enrolled
+    students, filtered by 'section' and 'group', that have a home directory. Without
+    one they are every home directory, as found by scanning HOMEDIR.
+    Check course_roster_error first.
+    """
+
+    if not course_roster.loaded:
+        students = [f.path for f in os.scandir(HOMEDIR) if f.is_dir()]
+        students = [x for x in students if '.' not in x]
+        return [s.replace(HOMEDIR, '') for s in students]
+
+    enrolled = course_roster.students(section, group)
+    students = [student for student in enrolled if cached_is_dir(HOMEDIR + student)]
+    if len(students) < len(enrolled):
+        logger.info(str(len(enrolled) - len(students)) + " Enrolled Students Have No Home Directory")
+    return students
+
+
+def roster_snapshot_students(snapshot_name, section=None, group=None):
+    """ Enrolled Students, Filtered by 'section' and 'group', That Have the Named Snapshot. """
+
+    return [student for student in course_roster.students(section, group)
+            if cached_is_dir(SNAPSHOT_DIR + student + '/' + snapshot_name)]
+
+
+def recover_snapshots():
+    """
+    Finish or Roll Back Snapshots Interrupted by a Crash, and Remove Stale Lock Files.
+    Staged snapshots are committed. Snapshots that were still copying are rolled back,
+    with partial rsync copies moved back to the intermediary directory so the next
+    snapshot of that student resumes from them.
+    """
+
+    # Remove Lock Files Nobody Holds
+    for lockfile in glob.glob(LOCK_DIR + COURSE_CODE + '_*.lock'):
+        student_id = os.path.basename(lockfile)[len(COURSE_CODE) + 1:-len('.lock')]
+        lockfile_obj = lock_student(student_id, blocking=False)
+        if lockfile_obj:
+            logger.info("Removing Stale Lock File: " + lockfile)
+            unlock_student(lockfile_obj)
+
+    for manifest_path in glob.glob(SNAPSHOT_DIR + '*/' + STAGING_DIRNAME + '/*.json'):
+        staging_path = manifest_path[:-len('.json')]  # Staging Path
+        snapshot_name_clean = os.path.basename(staging_path)
+        student_id = os.path.basename(os.path.dirname(os.path.dirname(staging_path)))
+
+        # No Request Can Hold the Lock at Startup, so This Only Waits Out an Hourly RSYNC of the Student
+        lockfile_obj = lock_student(student_id)
+
+        try:
+            try:
+                with open(manifest_path) as OPEN_FILE:
+                    manifest = json.load(OPEN_FILE)
+            except ValueError:
+                manifest = {}
+
+            if manifest.get('state') == 'staged':
+                logger.info("Completing Interrupted Snapshot " + snapshot_name_clean + " for Student: " + student_id)
+                commit_snapshot(student_id, snapshot_name_clean, manifest)
+            else:
+                rollback_snapshot(student_id, snapshot_name_clean, manifest)
+        except OSError as e:
+            logger.error("Error Recovering Snapshot " + snapshot_name_clean + " for Student: " + student_id + ": " + str(e))
+        finally:
+            unlock_student(lockfile_obj)
+
+
 def create_app(config_filename=None):
     app = Flask(__name__)
 
@@ -107,6 +613,9 @@ def create_app(config_filename=None):
             except OSError as e:
                 logger.error(f"Error creating directory '{directory_path}': {e}")
 
+    # Finish or Roll Back Snapshots Interrupted by a Previous Crash
+    recover_snapshots()
+
     # Default Flask HTTP 401 Error
     @app.errorhandler(401)
     def not_authorized(e):
@@ -177,11 +686,8 @@ def create_app(config_filename=None):
         snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
         snap_name_path = snap_student_path + '/' + snapshot_name  # Student Snapshot Path
 
-        snap_student_path_obj = Path(snap_student_path)  # Student Snapshot Directory Path Object
-        snap_name_path_obj = Path(snap_name_path)  # Student Snapshot Path Object
-
         # Error if Snapshot Directory Does Not Exist
-        if not (snap_student_path_obj.exists() and snap_student_path_obj.is_dir()):
+        if not cached_is_dir(snap_student_path):
             logger.info("Snapshots Directory Does NOT Exist for: " + str(student_id))
             return (jsonify(status=404,
                             error='Not Found - Snapshot Directory was Not Found',
@@ -189,19 +695,14 @@ def create_app(config_filename=None):
                             ), 404)
 
         # Error if Specific Snapshot Does Not Exist
-        if not (snap_name_path_obj.exists()
-                and snap_name_path_obj.is_dir()):
+        if not cached_is_dir(snap_name_path):
             logger.info("No Snapshot Found For Student: " + str(student_id) + " and Snapshot: " + str(snapshot_name))
             return (jsonify(status=404,
                             error='Not Found - Snapshot was Not Found',
                             message='Not Found - Snapshot Not Found.'), 404)
 
         # Get List Of Files In Snapshot Directory
-        snapshot_files = glob.glob(os.path.join(snap_name_path + '/', '**/*'),
-                                   recursive=True)
-        snapshot_files = [f for f in snapshot_files if os.path.isfile(f)]
-        snapshot_files = [s.replace(snap_name_path + '/', '') for s in
-                          snapshot_files]
+        snapshot_files = cached_list_snapshot_files(snap_name_path)
 
         # Error if No Snapshot Files Found
         if not snapshot_files:
@@ -241,19 +742,15 @@ def create_app(config_filename=None):
 
         snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
 
-        snap_student_path_obj = Path(snap_student_path)  # Student Snapshot Directory Path Object
-
         # Error if Snapshot Directory Does Not Exist
-        if not (snap_student_path_obj.exists() and snap_student_path_obj.is_dir()):
+        if not cached_is_dir(snap_student_path):
             return (jsonify(status=404,
                             error='Not Found - Snapshot Directory was Not Found',
                             message='Not Found - Student Snapshot Directory Not Found.'
                             ), 404)
 
         # Get List of Directories in Student Snapshot Directory
-        snapshots = [f.path for f in os.scandir(snap_student_path) if f.is_dir()]
-        snapshots = [x for x in snapshots if '.' not in x]
-        snapshots = [s.replace(snap_student_path + '/', '') for s in snapshots]
+        snapshots = cached_list_snapshots(snap_student_path)
 
         # Error No Snapshots Found
         if not snapshots:
@@ -311,27 +808,21 @@ def create_app(config_filename=None):
         snap_name_path = snap_student_path + '/' + snapshot_name  # Student Snapshot Path
         snap_file_path = snap_name_path + '/' + snapshot_filename  # Student Snapshot File Path
 
-        snap_student_path_obj = Path(snap_student_path)  # Student Snapshot Directory Path Object
-        snap_name_path_obj = Path(snap_name_path)  # Student Snapshot Path Object
-        snap_file_path_obj = Path(snap_file_path)  # Student Snapshot File Path Object
-
         # Error if Snapshot Directory Does Not Exist
-        if not (snap_student_path_obj.exists() and snap_student_path_obj.is_dir()):
+        if not cached_is_dir(snap_student_path):
             return (jsonify(status=404,
                             error='Not Found - Snapshot Directory was Not Found',
                             message='Not Found - Student Snapshot Directory Not Found.'
                             ), 404)
 
         # Error if Specific Snapshot Does Not Exist
-        if not (snap_name_path_obj.exists()
-                and snap_name_path_obj.is_dir()):
+        if not cached_is_dir(snap_name_path):
             return (jsonify(status=404,
                             error='Not Found - Snapshot was Not Found',
                             message='Not Found - Snapshot Not Found.'), 404)
 
         # Error if Requested Snapshot File Does Not Exist
-        if not (snap_file_path_obj.exists()
-                and snap_file_path_obj.is_file()):
+        if not cached_is_file(snap_file_path):
             return (jsonify(status=404,
                             error='Not Found - Snapshot File was Not Found',
                             message='Not Found - Snapshot File Not Found.'), 404)
@@ -359,8 +850,9 @@ def create_app(config_filename=None):
     # Curl Usage Command Examples For '/get_snapshot_zip' API Call
     # Required Post Variables: SNAPSHOT_NAME
     # Required Header Variables: X-Api-Key
-    # Optional Post Variables: STUDENT_ID
+    # Optional Post Variables: STUDENT_ID, SECTION, GROUP
     # If STUDENT_ID does not exist in the request, the whole snapshot will be archived and downloaded.
+    # With a course roster loaded the whole snapshot only includes enrolled students, optionally only those in SECTION and GROUP.
     # Example Response: curl: Saved to filename '31387714_12-08-2021.zip'
     #
     # curl -OJ -H "X-Api-Key: 12345" --data "STUDENT_ID=31387714&SNAPSHOT_NAME=12-08-2021" http://localhost:5000/get_snapshot_zip
@@ -374,6 +866,8 @@ def create_app(config_filename=None):
 
         student_id = request.form.get('STUDENT_ID')  # StudentID Post Variable
         snapshot_name = request.form.get('SNAPSHOT_NAME')  # Snapshot Name Variable
+        section = request.form.get('SECTION')  # Optional Roster Section Post Variable, Without STUDENT_ID
+        group = request.form.get('GROUP')  # Optional Roster Group Post Variable, Without STUDENT_ID
 
         # Error if StudentID Post Variable Missing
         # if not student_id:
@@ -393,64 +887,45 @@ def create_app(config_filename=None):
             snap_name_path = snap_path + '/' + snapshot_name  # Student Snapshot Path
             zip_file_name = student_id + '_' + snapshot_name + '.zip'  # Snapshot Zip File Name
 
-            snap_student_path_obj = Path(snap_path)  # Student Snapshot Directory Path Object
-            snap_name_path_obj = Path(snap_name_path)  # Student Snapshot Path Object
-
             # Error if Student Snapshot Directory Does Not Exist
-            if not (snap_student_path_obj.exists() and snap_student_path_obj.is_dir()):
+            if not cached_is_dir(snap_path):
                 return (jsonify(status=404,
                                 error='Not Found - Snapshot Directory was Not Found',
                                 message='Not Found - Student Snapshot Directory Not Found.'
                                 ), 404)
 
             # Error if Specific Snapshot Does Not Exist
-            if not (snap_name_path_obj.exists()
-                    and snap_name_path_obj.is_dir()):
+            if not cached_is_dir(snap_name_path):
                 return (jsonify(status=404,
                                 error='Not Found - Snapshot was Not Found',
                                 message='Not Found - Snapshot Not Found.'), 404)
 
-            # Create Zip File of Snapshot with Relative Path
-            snap_file = io.BytesIO()  # Create Empty File In Memory
-            with zf.ZipFile(snap_file, 'w') as snap_zip_file:  # Open Empty File as Zip File Object for Writing
-                for (dirname, subdirs, files) in os.walk(snap_name_path + '/'):  # Loop Through Snapshot Files and Directories
-                    if "/." not in dirname:
-                        snap_zip_file.write(dirname, dirname.replace(SNAPSHOT_DIR, ''))  # Add Directory to Zip File Object
-                        for filename in files:  # Loop Through Each File in Snapshot Directory
-                            if "/." not in filename:
-                                snap_zip_file.write(os.path.join(dirname, filename),
-                                                    os.path.join(dirname,
-                                                                 filename).replace(SNAPSHOT_DIR, ''),
-                                                    zf.ZIP_DEFLATED)  # Add Snapshot File To Zip File Object
-                snap_zip_file.close()  # Finish Writing to Zip File Object
+            students = None
         else:
-            snap_path = SNAPSHOT_DIR  # Student Snapshot Directory Path
-            snap_name_path = snap_path + '/' + snapshot_name  # Student Snapshot Path
             zip_file_name = snapshot_name + '.zip'  # Snapshot Zip File Name
-            snapshots = []
-
-            # loop through students directories to find which one has the snapshot
-            with os.scandir(snap_path) as student_dir:
-                for entry in student_dir:
-                    if entry.is_dir():
-                        with os.scandir(entry) as snapshot_dir:
-                            for e in snapshot_dir:
-                                # find the snapshot
-                                if e.is_dir() and e.name == snapshot_name:
-                                    snapshots.append(e.path)
-
-            # Create Zip File of Snapshot with Relative Path
-            snap_file = io.BytesIO()  # Create Empty File In Memory
-            with zf.ZipFile(snap_file, 'w') as snap_zip_file:  # Open Empty File as Zip File Object for Writing
-                for snapshot in snapshots:
-                    directory = pathlib.Path(snapshot)
-                    for file_path in directory.rglob("*"):
-                        snap_zip_file.write(
-                            file_path,
-                            arcname=str(file_path.relative_to(snap_path)).replace(snapshot_name+'/', ''),
-                            compress_type=zf.ZIP_DEFLATED
-                        )
-            snap_zip_file.close()  # Finish Writing to Zip File Object
+
+            # Error if the Course Roster Can Not be Read, or Filtering by Section or Group Without One
+            roster_error = course_roster_error(section, group)
+            if roster_error:
+                return (jsonify(status=roster_error[0],
+                                error=roster_error[1],
+                                message=roster_error[2]), roster_error[0])
+
+            # Only Archive Enrolled Students When a Roster is Loaded
+            students = roster_snapshot_students(snapshot_name, section, group) if course_roster.loaded else None
+
+            # Error if No Enrolled Student in the Section and Group Has the Snapshot
+            if students is not None and not students:
+                return (jsonify(status=404,
+                                error='Not Found - Snapshot was Not Found',
+                                message='Not Found - No Enrolled Student Snapshot Found.'), 404)
+
+        # Create Zip File of Snapshot with Relative Path
+        snap_file = io.BytesIO()  # Create Empty File In Memory
+        with zf.ZipFile(snap_file, 'w') as snap_zip_file:  # Open Empty File as Zip File Object for Writing
+            for (member_path, arcname, compress_type) in snapshot_zip_members(snapshot_name, student_id, students):
+                snap_zip_file.write(member_path, arcname, compress_type)  # Add Snapshot File or Directory To Zip File Object
+        snap_zip_file.close()  # Finish Writing to Zip File Object
 
         snap_file.seek(0)  # Reset position of Snap Zip File to Beginning
 
@@ -504,11 +979,10 @@ def create_app(config_filename=None):
         student_path = HOMEDIR + student_id  # Student Home Directory Path
         student_file_path = student_path + '/' + file_name  # Student Home File Path
 
-        student_path_obj = Path(student_path)  # Student Home Directory Path Object
         student_file_path_obj = Path(student_file_path)  # Student Uploaded File Path Object
 
         # Error if Student Home Does Not Exist
-        if not (student_path_obj.exists() and student_path_obj.is_dir()):
+        if not cached_is_dir(student_path):
             return (jsonify(status=404,
                             error='Not Found - Student Directory Not Found',
                             message='Not Found - STUDENT_ID Home Directory was Not Found.'
@@ -538,6 +1012,7 @@ def create_app(config_filename=None):
         # Move & Rename File from Upload Directory with Temp Name to Student Home Directory with Actual Name
         shutil.move(os.path.join(app.config['UPLOAD_FOLDER'],
                                  temp_file_name), student_file_path)
+        metadata_cache.invalidate(student_path)
 
         # Return Success Message
         return jsonify('Success - File Uploaded - ' + file_name), 200
@@ -584,15 +1059,11 @@ def create_app(config_filename=None):
         student_path = HOMEDIR + student_id  # Student Home Directory Path
         snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
         snap_name_path = snap_student_path + '/' + snapshot_name_clean  # Student Snapshot Path
-        lockfile = '/var/lock/' + COURSE_CODE + '_' + student_id + '.lock'  # Lock File For Student
-        intsnap_student_path = INTERMEDIARY_DIR + student_id
 
-        student_path_obj = Path(student_path)  # Student Home Directory Path Object
-        snap_student_path_obj = Path(snap_student_path)  # Student Snapshot Directory Path Object
         snap_name_path_obj = Path(snap_name_path)  # Student Snapshot Path Object
 
         # Error if Student Home Does Not Exist
-        if not (student_path_obj.exists() and student_path_obj.is_dir()):
+        if not cached_is_dir(student_path):
             return (jsonify(status=404,
                             error='Not Found - Student Directory Not Found',
                             message='Not Found - STUDENT_ID Home Directory was Not Found.'
@@ -612,43 +1083,19 @@ def create_app(config_filename=None):
                             error='Already Exists - Snapshot Name Already Exists',
                             message='Already Exists - Student Snapshot Already Exists.'), 404)
 
-        # Create FLOCK or Wait 2 Seconds
-        while True:
-            try:
-                lockfile_obj = open(lockfile, 'w+')  # Open Lock File, Create if Does Not Exist
-                fcntl.flock(lockfile_obj, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Create Non Blocking Exclusive Flock
-                break  # Break Out of While Loop if no Errors
-            except:
-                time.sleep(2)
-
-        # Create Student Home Directory Structure to Final Snapshot Directory If Missing
-        Path(snap_student_path).mkdir(parents=True, exist_ok=True)
-
-        options = ['-a', '-v', '-h', '-W']
-        if include_hidden:
-            exclusions = None
-        else:
-            exclusions = ['.*']
-        # RSYNC Student Home to Intermediate Snapshot Directory
-        sysrsync.run(source=student_path,
-                     destination=intsnap_student_path,
-                     sync_source_contents=True,
-                     options=options, exclusions=exclusions)
-
-        # Move Int Snap to Final Snap Location with New Name
-        shutil.move(intsnap_student_path, snap_name_path)
-
-        # Unlock Flock
-        fcntl.flock(lockfile_obj, fcntl.LOCK_UN)
-        lockfile_obj.close()
-        os.remove(lockfile)
+        # Error if the Snapshot was Created by Another Request While Waiting for the Lock
+        if take_snapshot(student_id, snapshot_name_clean, include_hidden) is None:
+            return (jsonify(status=404,
+                            error='Already Exists - Snapshot Name Already Exists',
+                            message='Already Exists - Student Snapshot Already Exists.'), 404)
 
         # Return Success Message
         return jsonify('Success - Snapshot Created - ' + snapshot_name_clean + ' for Student: ' + student_id), 200
 
     # Curl Usage Command Examples For '/snapshot_all' API Call
     # Required Post Variables: SNAPSHOT_NAME
-    # Optional Post Variables: INCLUDE_HIDDEN
+    # Optional Post Variables: INCLUDE_HIDDEN, SECTION, GROUP
+    # With a course roster loaded only enrolled students are snapshotted, optionally only those in SECTION and GROUP.
     # Required Header Variables: X-Api-Key
     # Example Response:
     #
@@ -664,6 +1111,8 @@ def create_app(config_filename=None):
         """ Create a Snapshot of tll the Student's Home Directories with the Specified Snapshot Name. """
 
         snapshot_name = request.form.get('SNAPSHOT_NAME')  # SNAPSHOT_NAME Post Variable
+        section = request.form.get('SECTION')  # Optional Roster Section Post Variable
+        group = request.form.get('GROUP')  # Optional Roster Group Post Variable
         # whether to include hidden directories
         include_hidden = request.form.get('INCLUDE_HIDDEN', "false").lower() == 'true'
 
@@ -678,10 +1127,21 @@ def create_app(config_filename=None):
                             message='Not Acceptable - Missing SNAPSHOT_NAME Post Value.'
                             ), 406)
 
-        # Get List of Directories in Student Snapshot Directory
-        students = [f.path for f in os.scandir(HOMEDIR) if f.is_dir()]
-        students = [x for x in students if '.' not in x]
-        students = [s.replace(HOMEDIR, '') for s in students]
+        # Error if the Course Roster Can Not be Read, or Filtering by Section or Group Without One
+        roster_error = course_roster_error(section, group)
+        if roster_error:
+            return (jsonify(status=roster_error[0],
+                            error=roster_error[1],
+                            message=roster_error[2]), roster_error[0])
+
+        # Get List of Enrolled Students, or of Student Home Directories Without a Roster
+        students = course_students(section, group)
+
+        # Error if There are No Students to Snapshot
+        if not students:
+            return (jsonify(status=404,
+                            error='Not Found - No Students Found',
+                            message='Not Found - No Student Home Directories Found.'), 404)
 
         snapshot_name_clean = slugify(snapshot_name)  # Ensure The SNAPSHOT_NAME is a Safe Filename
         snapshot_name_clean = snapshot_name_clean + '_' + date  # Add Date to SNAPSHOT_NAME_CLEAN
@@ -707,46 +1167,84 @@ def create_app(config_filename=None):
                                 error='Already Exists - Snapshot Name Already Exists',
                                 message='Already Exists - Student (' + student + ') Snapshot Already Exists.'), 404)
 
-        # Create Snapshots for All Students
+        # Create Snapshots for All Students, Skipping Any Created by Another Request Meanwhile
+        snapshot_count = 0
+        unchanged_count = 0
         for student in students:
-            student_path = HOMEDIR + student  # Student Home Directory Path
-            snap_student_path = SNAPSHOT_DIR + student  # Student Snapshot Directory Path
-            snap_name_path = snap_student_path + '/' + snapshot_name_clean  # Student Snapshot Path
-            lockfile = '/var/lock/' + COURSE_CODE + '_' + student + '.lock'  # Lock File For Student
-            intsnap_student_path = INTERMEDIARY_DIR + student
-
-            # Create FLOCK or Wait 2 Seconds
-            while True:
-                try:
-                    lockfile_obj = open(lockfile, 'w+')  # Open Lock File, Create if Does Not Exist
-                    fcntl.flock(lockfile_obj, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Create Non Blocking Exclusive Flock
-                    break  # Break Out of While Loop if no Errors
-                except Exception as e:
-                    time.sleep(2)
-
-            # Create Student Home Directory Structure to Final Snapshot Directory If Missing
-            Path(snap_student_path).mkdir(parents=True, exist_ok=True)
-
-            # RSYNC Student Home to Intermediate Snapshot Directory
-            options = ['-a', '-v', '-h', '-W']
-            if include_hidden:
-                exclusions = None
-            else:
-                exclusions = ['.*']
-            sysrsync.run(source=student_path,
-                         destination=intsnap_student_path,
-                         sync_source_contents=True,
-                         options=options, verbose=True, exclusions=exclusions)
+            linked = take_snapshot(student, snapshot_name_clean, include_hidden)
+            if linked is not None:
+                snapshot_count += 1
+            if linked is True:
+                unchanged_count += 1
+        logger.info("Snapshot " + snapshot_name_clean + " Linked " + str(unchanged_count) + " Unchanged of "
+                    + str(snapshot_count) + " Students")
 
-            # Move Int Snap to Final Snap Location with New Name
-            shutil.move(intsnap_student_path, snap_name_path)
+        # Return Success Message
+        return jsonify('Success - Snapshot Created - ' + snapshot_name_clean + ' for ' + str(snapshot_count)
+                       + ' Students'), 200
+
+    # Curl Usage Command Examples For '/snapshot_changed' API Call
+    # Required Post Variables: STUDENT_ID, SNAPSHOT_NAME
+    # Required Header Variables: X-Api-Key
+    # Example Response: {"changed":true,"snapshot_name":"assignment-1_2021-09-01","student_id":"31387714"}
+    #
+    # curl -H "X-Api-Key: 12345" -d "STUDENT_ID=31387714" -d "SNAPSHOT_NAME=assignment-1_2021-09-01" http://localhost:5000/snapshot_changed
+    #
+    @app.route('/snapshot_changed', methods=['POST'])
+    @requires_apikey
+    def snapshot_changed():
+        """ Check Whether the Specified Student's Home Directory Has Changed Since the Specified Snapshot. """
 
-            # Unlock Flock
-            fcntl.flock(lockfile_obj, fcntl.LOCK_UN)
-            lockfile_obj.close()
-            os.remove(lockfile)
+        student_id = request.form.get('STUDENT_ID')  # StudentID Post Variable
+        snapshot_name = request.form.get('SNAPSHOT_NAME')  # Snapshot Name Variable
 
-        # Return Success Message
-        return jsonify('Success - Snapshot Created - ' + snapshot_name_clean + ' for All Students'), 200
+        # Error if StudentID Post Variable Missing
+        if not student_id:
+            return (jsonify(status=406,
+                            error='Not Acceptable - Missing Data',
+                            message='Not Acceptable - Missing STUDENT_ID Post Value.'
+                            ), 406)
+
+        # Error if Snapshot Name Post Variable Missing
+        if not snapshot_name:
+            return (jsonify(status=406,
+                            error='Not Acceptable - Missing Data',
+                            message='Not Acceptable - Missing SNAPSHOT_NAME Post Value.'
+                            ), 406)
+
+        student_path = HOMEDIR + student_id  # Student Home Directory Path
+
+        # Error if Student Home Does Not Exist
+        if not cached_is_dir(student_path):
+            return (jsonify(status=404,
+                            error='Not Found - Student Directory Not Found',
+                            message='Not Found - STUDENT_ID Home Directory was Not Found.'
+                            ), 404)
+
+        # Error if No Signature was Recorded for the Snapshot
+        record = read_signatures(student_id).get(snapshot_name)
+        if not record:
+            return (jsonify(status=404,
+                            error='Not Found - Snapshot Signature was Not Found',
+                            message='Not Found - No Signature Recorded for the Snapshot.'), 404)
+
+        signature = directory_signature(student_path, record['include_hidden'])
+
+        # Return Whether the Home Directory Signature Differs From the Snapshot's
+        return jsonify(student_id=student_id, snapshot_name=snapshot_name,
+                       changed=signature != record['signature']), 200
+
+    # Curl Usage Command Examples For '/metadata_cache_stats' API Call
+    # Required Header Variables: X-Api-Key
+    # Example Response: {"hit_rate":0.9,"hits":9,"invalidations":0,"maxsize":4096,"misses":1,"size":1,"ttl":30.0}
+    #
+    # curl -X POST -H "X-Api-Key: 12345" http://localhost:5000/metadata_cache_stats
+    #
+    @app.route('/metadata_cache_stats', methods=['POST'])
+    @requires_apikey
+    def metadata_cache_stats():
+        """ Get the Hit and Miss Counters of the Filesystem Metadata Cache. """
+
+        return jsonify(metadata_cache.stats()), 200
 
     return app
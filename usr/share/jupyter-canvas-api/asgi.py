@@ -0,0 +1,463 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Serves the Jupyter Canvas API as an ASGI application, as an alternative to the
+WSGI application in wsgi.py. The I/O bound listing and download routes are
+handled natively: their filesystem calls run on a bounded thread pool and their
+responses are streamed from async generators, so slow NFS calls and long zip
+downloads no longer hold a server thread each. Every other route is passed to
+the Flask application from create_app on a separate thread pool.
+"""
+
+import asyncio
+import io
+import json
+import os
+import zipfile as zf
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import dump_options_header
+from werkzeug.wrappers import Request
+
+from api_server import (APIKEY, SNAPSHOT_DIR, cached_is_dir, cached_is_file, cached_list_snapshot_files,
+                        cached_list_snapshots, course_roster, course_roster_error, create_app, logger,
+                        roster_snapshot_students, snapshot_zip_members)
+
+# ASGI Variables Defined by Environment Variable
+FS_WORKERS = int(os.getenv('ASGI_FS_WORKERS', '16'))  # Threads for Filesystem Calls of Native Routes
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '4'))  # Threads for Routes Served by the Flask Application
+CHUNK_SIZE = 1024 * 1024  # Bytes Read From a Snapshot File per Filesystem Call
+
+fs_executor = ThreadPoolExecutor(max_workers=FS_WORKERS, thread_name_prefix='asgi-fs')
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+flask_app = create_app()
+
+
+class ApiError(Exception):
+    """ Raised by Native Routes to Send a JSON Error Response. """
+
+    def __init__(self, status, error, message):
+        super().__init__(message)
+        self.status = status
+        self.error = error
+        self.message = message
+
+
+class ZipStream:
+    """ Unseekable File Object That Collects Zip File Output Until it is Drained. """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def run_fs(func, *args):
+    """ Run a Blocking Filesystem Call on the Bounded Filesystem Thread Pool. """
+
+    return await asyncio.get_running_loop().run_in_executor(fs_executor, func, *args)
+
+
+def json_body(data):
+    """ Encode 'data' the Same Way as Flask's jsonify. """
+
+    return (json.dumps(data, separators=(',', ':'), sort_keys=True) + '\n').encode()
+
+
+async def single_chunk(data):
+    yield data
+
+
+def build_environ(scope, body):
+    """ Build a WSGI Environ for an ASGI HTTP Scope and its Complete Request Body. """
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope['http_version'],
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for (name, value) in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    """ Run the Flask Application for One Request and Collect its Response. """
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.encode('latin-1'), v.encode('latin-1')) for (k, v) in headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def get_snapshot_file_list(form):
+    """ Get List of Snapshot Files for the Specified Student and Snapshot. """
+
+    student_id = form.get('STUDENT_ID')  # StudentID Post Variable
+    snapshot_name = form.get('SNAPSHOT_NAME')  # Snapshot Name Variable
+
+    # Error if StudentID Post Variable Missing
+    if not student_id:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing StudentID Post Value.')
+
+    # Error if Snapshot Name Post Variable Missing
+    if not snapshot_name:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing SNAPSHOT_NAME Post Value.')
+
+    snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+    snap_name_path = snap_student_path + '/' + snapshot_name  # Student Snapshot Path
+
+    # Error if Snapshot Directory Does Not Exist
+    if not await run_fs(cached_is_dir, snap_student_path):
+        logger.info("Snapshots Directory Does NOT Exist for: " + str(student_id))
+        raise ApiError(404, 'Not Found - Snapshot Directory was Not Found',
+                       'Not Found - Student Snapshot Directory Not Found.')
+
+    # Error if Specific Snapshot Does Not Exist
+    if not await run_fs(cached_is_dir, snap_name_path):
+        logger.info("No Snapshot Found For Student: " + str(student_id) + " and Snapshot: " + str(snapshot_name))
+        raise ApiError(404, 'Not Found - Snapshot was Not Found', 'Not Found - Snapshot Not Found.')
+
+    snapshot_files = await run_fs(cached_list_snapshot_files, snap_name_path)
+
+    # Error if No Snapshot Files Found
+    if not snapshot_files:
+        logger.info("No Snapshots Files Found For Student: " + str(student_id) + " and Snapshot: " + str(snapshot_name))
+        raise ApiError(404, 'Not Found - No Snapshots Found', 'Not Found - No Snapshot Directories Found.')
+
+    return 200, [(b'content-type', b'application/json')], single_chunk(json_body(snapshot_files))
+
+
+async def get_snapshot_list(form):
+    """ Get List of Snapshot Directories for the Specified Student. """
+
+    student_id = form.get('STUDENT_ID')  # StudentID Post Variable
+
+    # Error if StudentID Post Variable Missing
+    if not student_id:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing StudentID Post Value.')
+
+    snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+
+    # Error if Snapshot Directory Does Not Exist
+    if not await run_fs(cached_is_dir, snap_student_path):
+        raise ApiError(404, 'Not Found - Snapshot Directory was Not Found',
+                       'Not Found - Student Snapshot Directory Not Found.')
+
+    snapshots = await run_fs(cached_list_snapshots, snap_student_path)
+
+    # Error No Snapshots Found
+    if not snapshots:
+        raise ApiError(404, 'Not Found - No Snapshots Found', 'Not Found - No Snapshot Directories Found.')
+
+    return 200, [(b'content-type', b'application/json')], single_chunk(json_body(snapshots))
+
+
+async def stream_file(file_path):
+    """ Stream a File in CHUNK_SIZE Pieces, Reading Each Piece on the Filesystem Thread Pool. """
+
+    open_file = await run_fs(open, file_path, 'rb')
+    try:
+        while True:
+            data = await run_fs(open_file.read, CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        await run_fs(open_file.close)
+
+
+async def get_snapshot_file(form):
+    """ Get the Specified File from Specified Student Snapshot. """
+
+    student_id = form.get('STUDENT_ID')  # StudentID Post Variable
+    snapshot_name = form.get('SNAPSHOT_NAME')  # Snapshot Name Variable
+    snapshot_filename = form.get('SNAPSHOT_FILENAME')  # Snapshot File Name Variable
+
+    # Error if StudentID Post Variable Missing
+    if not student_id:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing STUDENT_ID Post Value.')
+
+    # Error if Snapshot Name Post Variable Missing
+    if not snapshot_name:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing SNAPSHOT_NAME Post Value.')
+
+    # Error if Snapshot File Name Post Variable Missing
+    if not snapshot_filename:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing SNAPSHOT_FILENAME Post Value.')
+
+    snap_student_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+    snap_name_path = snap_student_path + '/' + snapshot_name  # Student Snapshot Path
+    snap_file_path = snap_name_path + '/' + snapshot_filename  # Student Snapshot File Path
+
+    # Error if Snapshot Directory Does Not Exist
+    if not await run_fs(cached_is_dir, snap_student_path):
+        raise ApiError(404, 'Not Found - Snapshot Directory was Not Found',
+                       'Not Found - Student Snapshot Directory Not Found.')
+
+    # Error if Specific Snapshot Does Not Exist
+    if not await run_fs(cached_is_dir, snap_name_path):
+        raise ApiError(404, 'Not Found - Snapshot was Not Found', 'Not Found - Snapshot Not Found.')
+
+    # Error if Requested Snapshot File Does Not Exist
+    if not await run_fs(cached_is_file, snap_file_path):
+        raise ApiError(404, 'Not Found - Snapshot File was Not Found', 'Not Found - Snapshot File Not Found.')
+
+    snapshot_file_extension = snapshot_filename.rsplit('.', 1)[-1]  # File Extension
+    snapshot_short_filename = snapshot_filename.rsplit('/', 1)[-1]  # File Name Without Directory
+
+    headers = [(b'content-type', snapshot_file_extension.encode('latin-1')),
+               (b'content-disposition',
+                dump_options_header('attachment', {'filename': snapshot_short_filename}).encode('latin-1'))]
+    return 200, headers, stream_file(snap_file_path)
+
+
+def open_zip_member(snap_zip_file, member_path, arcname, compress_type):
+    """ Add a Directory Member, or Open a File Member for Writing, in a Streamed Zip File. """
+
+    if os.path.isdir(member_path):
+        snap_zip_file.write(member_path, arcname, compress_type)
+        return None, None
+    zip_info = zf.ZipInfo.from_file(member_path, arcname)
+    zip_info.compress_type = compress_type if compress_type is not None else zf.ZIP_STORED
+    return open(member_path, 'rb'), snap_zip_file.open(zip_info, 'w')
+
+
+def copy_zip_chunk(member_file, member_zip_file):
+    """ Copy One Chunk of a File Into its Zip Member, Closing Both at the End of the File. """
+
+    data = member_file.read(CHUNK_SIZE)
+    if data:
+        member_zip_file.write(data)
+        return True
+    member_zip_file.close()
+    member_file.close()
+    return False
+
+
+async def stream_zip(snapshot_name, student_id, students):
+    """
+    Stream a Snapshot Zip File. Each file is compressed one chunk per filesystem call,
+    and the output written so far is sent between calls.
+    """
+
+    zip_stream = ZipStream()
+    snap_zip_file = zf.ZipFile(zip_stream, 'w')
+    members = await run_fs(list, snapshot_zip_members(snapshot_name, student_id, students))
+    for (member_path, arcname, compress_type) in members:
+        member_file, member_zip_file = await run_fs(open_zip_member, snap_zip_file, member_path, arcname,
+                                                    compress_type)
+        if member_file:
+            try:
+                while await run_fs(copy_zip_chunk, member_file, member_zip_file):
+                    data = zip_stream.drain()
+                    if data:
+                        yield data
+            finally:
+                await run_fs(member_file.close)
+        data = zip_stream.drain()
+        if data:
+            yield data
+    await run_fs(snap_zip_file.close)
+    yield zip_stream.drain()
+
+
+async def get_snapshot_zip(form):
+    """ Get Zip File of Specified Student Snapshot. """
+
+    student_id = form.get('STUDENT_ID')  # StudentID Post Variable
+    snapshot_name = form.get('SNAPSHOT_NAME')  # Snapshot Name Variable
+    section = form.get('SECTION')  # Optional Roster Section Post Variable, Without STUDENT_ID
+    group = form.get('GROUP')  # Optional Roster Group Post Variable, Without STUDENT_ID
+
+    # Error if Snapshot Name Post Variable Missing
+    if not snapshot_name:
+        raise ApiError(406, 'Not Acceptable - Missing Data', 'Not Acceptable - Missing SNAPSHOT_NAME Post Value.')
+
+    students = None
+    if student_id:
+        snap_path = SNAPSHOT_DIR + student_id  # Student Snapshot Directory Path
+        snap_name_path = snap_path + '/' + snapshot_name  # Student Snapshot Path
+        zip_file_name = student_id + '_' + snapshot_name + '.zip'  # Snapshot Zip File Name
+
+        # Error if Student Snapshot Directory Does Not Exist
+        if not await run_fs(cached_is_dir, snap_path):
+            raise ApiError(404, 'Not Found - Snapshot Directory was Not Found',
+                           'Not Found - Student Snapshot Directory Not Found.')
+
+        # Error if Specific Snapshot Does Not Exist
+        if not await run_fs(cached_is_dir, snap_name_path):
+            raise ApiError(404, 'Not Found - Snapshot was Not Found', 'Not Found - Snapshot Not Found.')
+    else:
+        zip_file_name = snapshot_name + '.zip'  # Snapshot Zip File Name
+        # Error if the Course Roster Can Not be Read, or Filtering by Section or Group Without One
+        roster_error = await run_fs(course_roster_error, section, group)
+        if roster_error:
+            raise ApiError(*roster_error)
+
+        # Only Archive Enrolled Students When a Roster is Loaded
+        if await run_fs(lambda: course_roster.loaded):
+            students = await run_fs(roster_snapshot_students, snapshot_name, section, group)
+
+            # Error if No Enrolled Student in the Section and Group Has the Snapshot
+            if not students:
+                raise ApiError(404, 'Not Found - Snapshot was Not Found',
+                               'Not Found - No Enrolled Student Snapshot Found.')
+
+    headers = [(b'content-type', b'zip'),
+               (b'content-disposition',
+                dump_options_header('attachment', {'filename': zip_file_name}).encode('latin-1'))]
+    return 200, headers, stream_zip(snapshot_name, student_id, students)
+
+
+# Routes Served Natively, All Other Routes are Served by the Flask Application
+native_routes = {
+    '/get_snapshot_file_list': get_snapshot_file_list,
+    '/get_snapshot_list': get_snapshot_list,
+    '/get_snapshot_file': get_snapshot_file,
+    '/get_snapshot_zip': get_snapshot_zip,
+}
+
+
+async def read_body(receive):
+    """ Read the Complete Request Body, Refusing Bodies Larger than Flask's MAX_CONTENT_LENGTH. """
+
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('Client Disconnected')
+        body += message.get('body', b'')
+        if len(body) > flask_app.config['MAX_CONTENT_LENGTH']:
+            raise ApiError(413, 'Request Entity Too Large', 'The data value transmitted exceeds the capacity limit.')
+        if not message.get('more_body', False):
+            return bytes(body)
+
+
+async def watch_disconnect(receive, disconnected):
+    """ Set 'disconnected' When the Client Goes Away, Once the Request Body Has Been Read. """
+
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def send_response(send, receive, status, headers, body_iterator):
+    """
+    Send a Response, Streaming 'body_iterator' Until it Ends or the Client Disconnects.
+    The server's send() returns quietly after a disconnect, so receive() is watched
+    instead, and the body is closed so open snapshot files are released.
+    """
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    try:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        async for data in body_iterator:
+            if disconnected.is_set():
+                logger.info("Client Disconnected, Response Stream Stopped")
+                return
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        watcher.cancel()
+        await body_iterator.aclose()
+
+
+def error_response(status, error, message):
+    return (status, [(b'content-type', b'application/json')],
+            single_chunk(json_body({'status': status, 'error': error, 'message': message})))
+
+
+async def application(scope, receive, send):
+    """ ASGI Entry Point. """
+
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                fs_executor.shutdown(wait=False)
+                wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    try:
+        body = await read_body(receive)
+    except ApiError as e:
+        await send_response(send, receive, *error_response(e.status, e.error, e.message))
+        return
+    except ConnectionError:
+        return
+
+    environ = build_environ(scope, body)
+    route = native_routes.get(scope['path'])
+
+    # Pass Routes Not Served Natively to the Flask Application
+    if route is None or scope['method'] != 'POST':
+        loop = asyncio.get_running_loop()
+        status, headers, flask_body = await loop.run_in_executor(wsgi_executor, call_flask, environ)
+        await send_response(send, receive, status, headers, single_chunk(flask_body))
+        return
+
+    wsgi_request = Request(environ)
+
+    # Same API Key Check as the Flask Application
+    if not (APIKEY and APIKEY == wsgi_request.headers.get('X-Api-Key')):
+        if wsgi_request.headers.getlist("X-Forwarded-For"):
+            client_ip_address = str(wsgi_request.headers.getlist("X-Forwarded-For"))
+        else:
+            client_ip_address = wsgi_request.remote_addr
+        logger.error("Invalid Authentication from IP: " + str(client_ip_address))
+        await send_response(send, receive, *error_response(401, 'Not Authorized',
+                                                           'You are Not authorized to access the URL requested.'))
+        return
+
+    try:
+        response = await route(wsgi_request.form)
+    except ApiError as e:
+        response = error_response(e.status, e.error, e.message)
+    await send_response(send, receive, *response)
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Compares the WSGI (waitress) and ASGI (uvicorn) serving modes of the API.
+Builds a throwaway course of student snapshots, starts each server in turn, and
+measures list call latency while large zip downloads run at the same time, which
+is the deadline time load that ties up every waitress thread.
+
+Usage: python3 benchmark.py [--students 50] [--zips 8] [--lists 200] [--threads 4]
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+API_KEY = 'benchmark'
+SNAPSHOT_NAME = 'benchmark_snapshot'
+
+
+def build_course(base_dir, students, file_count, file_size):
+    """ Create Home, Snapshot and Intermediary Directories with One Snapshot per Student. """
+
+    for student in range(students):
+        snap_name_path = os.path.join(base_dir, 'snap', str(10000000 + student), SNAPSHOT_NAME)
+        os.makedirs(snap_name_path)
+        os.makedirs(os.path.join(base_dir, 'home', str(10000000 + student)))
+        for file_number in range(file_count):
+            with open(os.path.join(snap_name_path, 'file-%d.ipynb' % file_number), 'wb') as OPEN_FILE:
+                OPEN_FILE.write(os.urandom(file_size // 2) + b'\0' * (file_size // 2))
+    os.makedirs(os.path.join(base_dir, 'internal'))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def post(port, path, data):
+    """ POST Form Data to the API and Return the Elapsed Seconds. """
+
+    start = time.perf_counter()
+    request = urllib.request.Request('http://127.0.0.1:%d%s' % (port, path),
+                                     data=urllib.parse.urlencode(data).encode(),
+                                     headers={'X-Api-Key': API_KEY})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        while response.read(1024 * 1024):
+            pass
+    return time.perf_counter() - start
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Server did not start on port %d' % port)
+
+
+def run_mode(name, command, env, port, args):
+    """ Start a Server, Run the Mixed Zip and List Load Against it, and Print the Results. """
+
+    server = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        post(port, '/get_snapshot_list', {'STUDENT_ID': '10000000'})  # Warm Up
+
+        zip_times = []
+        list_times = []
+        zips_done = threading.Event()
+
+        def download_zips():
+            with ThreadPoolExecutor(max_workers=args.zips) as pool:
+                zip_times.extend(pool.map(lambda i: post(port, '/get_snapshot_zip',
+                                                         {'SNAPSHOT_NAME': SNAPSHOT_NAME}), range(args.zips)))
+            zips_done.set()
+
+        start = time.perf_counter()
+        zip_thread = threading.Thread(target=download_zips)
+        zip_thread.start()
+        time.sleep(0.5)  # Let the Downloads Occupy the Server First
+
+        with ThreadPoolExecutor(max_workers=args.list_clients) as pool:
+            list_times.extend(pool.map(
+                lambda i: post(port, '/get_snapshot_list', {'STUDENT_ID': str(10000000 + i % args.students)}),
+                range(args.lists)))
+        zip_thread.join()
+        elapsed = time.perf_counter() - start
+
+        list_times.sort()
+        print('%-5s lists: p50 %7.1f ms  p95 %7.1f ms  max %7.1f ms | zips: mean %6.2f s | total %6.2f s' % (
+            name,
+            statistics.median(list_times) * 1000,
+            list_times[int(len(list_times) * 0.95) - 1] * 1000,
+            list_times[-1] * 1000,
+            statistics.mean(zip_times),
+            elapsed))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=50, help='Number of Students')
+    parser.add_argument('--files', type=int, default=4, help='Files per Snapshot')
+    parser.add_argument('--file-size', type=int, default=512 * 1024, help='Bytes per Snapshot File')
+    parser.add_argument('--zips', type=int, default=8, help='Concurrent Course Zip Downloads')
+    parser.add_argument('--lists', type=int, default=200, help='List Calls Made During the Downloads')
+    parser.add_argument('--list-clients', type=int, default=8, help='Concurrent List Call Clients')
+    parser.add_argument('--threads', type=int, default=4, help='WAITRESS_THREADS for the WSGI Mode')
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix='jupyter-canvas-api-benchmark-')
+    try:
+        build_course(base_dir, args.students, args.files, args.file_size)
+        env = dict(os.environ,
+                   JUPYTER_API_KEY=API_KEY,
+                   JNOTE_COURSE_CODE='BENCHMARK',
+                   JNOTE_HOME=os.path.join(base_dir, 'home'),
+                   JNOTE_SNAP=os.path.join(base_dir, 'snap'),
+                   JNOTE_INTSNAP=os.path.join(base_dir, 'internal'),
+                   ASGI_WSGI_THREADS=str(args.threads))
+
+        print('%d students x %d files x %d bytes, %d zip downloads, %d list calls, %d waitress threads' % (
+            args.students, args.files, args.file_size, args.zips, args.lists, args.threads))
+
+        port = free_port()
+        run_mode('wsgi', [sys.executable, '-m', 'waitress', '--port=%d' % port, '--threads=%d' % args.threads,
+                          'wsgi:application'], env, port, args)
+
+        port = free_port()
+        run_mode('asgi', [sys.executable, '-m', 'uvicorn', '--port', str(port), '--no-access-log',
+                          'asgi:application'], env, port, args)
+    finally:
+        shutil.rmtree(base_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Loads a course roster exported from Canvas so course-wide operations only visit
+enrolled students. The roster is a local CSV or JSON file standing in for the
+Canvas enrollments API: a Canvas gradebook CSV export, a JSON list of Canvas
+enrollment or user objects, or any CSV/JSON with an ID column and optional
+Section and Group columns. A student in several sections or groups may appear
+on several rows. The file is reloaded whenever it changes on disk.
+
+Run directly to print the roster's student IDs one per line, for the hourly
+rsync script:  python3 roster.py [ROSTER_FILE]
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+
+ID_FIELDS = ('user_id', 'STUDENT_ID', 'ID', 'id', 'Canvas ID', 'canvas_id')  # Canvas Student ID Columns, user_id Before Enrollment id
+SECTION_FIELDS = ('Section', 'section', 'section_name', 'course_section_id')  # Section Columns
+GROUP_FIELDS = ('Group', 'group', 'group_name', 'group_id')  # Group Columns
+STATE_FIELDS = ('enrollment_state', 'Enrollment State')  # Enrollment State Columns, Only 'active' is Kept
+TYPE_FIELDS = ('type', 'Enrollment Type')  # Enrollment Type Columns, Only Student Enrollments are Kept
+
+logger = logging.getLogger('Jupyter-Canvas-API')
+
+
+def first_field(row, fields):
+    """ Return the First Non Empty Value in 'row' of the Named Fields, as a Stripped String. """
+
+    for field in fields:
+        value = row.get(field)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def read_rows(path):
+    """ Read the Roster File's Rows as Dictionaries, From CSV or JSON Depending on its Extension. """
+
+    if path.lower().endswith('.json'):
+        with open(path) as OPEN_FILE:
+            data = json.load(OPEN_FILE)
+        if isinstance(data, dict):  # Accept {"students": [...]} or {"enrollments": [...]} Wrappers
+            data = data.get('students') or data.get('enrollments') or []
+        return [row for row in data if isinstance(row, dict)]
+
+    with open(path, newline='', encoding='utf-8-sig') as OPEN_FILE:
+        return list(csv.DictReader(OPEN_FILE))
+
+
+class Roster:
+    """ In Memory Set of Enrolled Student IDs, With the Students in Each Section and Group. """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_key = None  # (st_mtime_ns, st_size) of the Loaded File
+        self.error = None  # Last Error Reading the Roster File, Logged Once
+        self.student_ids = frozenset()
+        self.sections = {}  # Maps Section to Set of Student IDs
+        self.groups = {}  # Maps Group to Set of Student IDs
+
+    @property
+    def loaded(self):
+        """ True if a Roster File is Configured and Could be Read. """
+
+        self.refresh()
+        return bool(self.path) and self.file_key is not None
+
+    def refresh(self):
+        """ Reload the Roster if the File Has Changed Since it was Last Read. """
+
+        if not self.path:
+            return
+        try:
+            file_stat = os.stat(self.path)
+        except OSError as e:
+            self.log_error("Error Reading Roster File '" + self.path + "': " + str(e))
+            with self.lock:
+                self.file_key = None
+                self.student_ids = frozenset()
+                self.sections = {}
+                self.groups = {}
+            return
+
+        file_key = (file_stat.st_mtime_ns, file_stat.st_size)
+        if file_key == self.file_key:
+            return
+
+        try:
+            rows = read_rows(self.path)
+        except (OSError, ValueError, csv.Error) as e:
+            if self.file_key is None:
+                self.log_error("Error Reading Roster File '" + self.path + "': " + str(e))
+            else:
+                self.log_error("Error Reading Roster File '" + self.path + "', Keeping Previous Roster: " + str(e))
+            return
+
+        student_ids = set()
+        sections = {}
+        groups = {}
+        for row in rows:
+            student_id = first_field(row, ID_FIELDS)
+            state = first_field(row, STATE_FIELDS)
+            enrollment_type = first_field(row, TYPE_FIELDS)
+
+            # Skip Rows Without a Usable ID, Such as the Canvas Gradebook "Points Possible" Row
+            if not student_id or '/' in student_id or '.' in student_id:
+                continue
+            if state and state.lower() != 'active':
+                continue
+            if enrollment_type and 'student' not in enrollment_type.lower():
+                continue
+
+            student_ids.add(student_id)
+            section = first_field(row, SECTION_FIELDS)
+            if section:
+                sections.setdefault(section, set()).add(student_id)
+            group = first_field(row, GROUP_FIELDS)
+            if group:
+                groups.setdefault(group, set()).add(student_id)
+
+        with self.lock:
+            self.file_key = file_key
+            self.error = None
+            self.student_ids = frozenset(student_ids)
+            self.sections = sections
+            self.groups = groups
+
+    def log_error(self, message):
+        """ Log a Roster Error, Unless it is the Same Error as Last Time. """
+
+        if message != self.error:
+            logger.error(message)
+            self.error = message
+
+    def has_section(self, section):
+        """ True if 'section' is a Section of the Loaded Roster. """
+
+        self.refresh()
+        with self.lock:
+            return section in self.sections
+
+    def has_group(self, group):
+        """ True if 'group' is a Group of the Loaded Roster. """
+
+        self.refresh()
+        with self.lock:
+            return group in self.groups
+
+    def students(self, section=None, group=None):
+        """ Sorted IDs of the Enrolled Students, Optionally Only Those in 'section' and 'group'. """
+
+        self.refresh()
+        with self.lock:
+            student_ids = self.student_ids
+            if section:
+                student_ids = student_ids & self.sections.get(section, set())
+            if group:
+                student_ids = student_ids & self.groups.get(group, set())
+        return sorted(student_ids)
+
+
+if __name__ == '__main__':
+    roster = Roster(sys.argv[1] if len(sys.argv) > 1 else os.getenv('JNOTE_ROSTER', ''))
+    if not roster.loaded:
+        sys.exit('Roster File Could Not be Read: ' + str(roster.error or roster.path))
+    for roster_student_id in roster.students():
+        print(roster_student_id)
@@ -16,6 +16,12 @@ else
     echo "There is no script $PRE_START_PATH"
 fi
 
+# Start Uvicorn Instead of Waitress When the ASGI Serving Mode is Selected
+if [[ "${API_SERVER_MODE,,}" == "asgi" ]]; then
+  echo "uvicorn --host=${WAITRESS_HOST:-0.0.0.0} --port=${WAITRESS_PORT:-80} asgi:application"
+  exec uvicorn --host="${WAITRESS_HOST:-0.0.0.0}" --port="${WAITRESS_PORT:-80}" asgi:application
+fi
+
 params=""
 
 if [[ -v WAITRESS_LISTEN ]]; then